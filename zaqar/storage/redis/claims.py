@@ -12,9 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import functools
-
-import msgpack
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
 
@@ -44,7 +41,8 @@ class ClaimController(storage.Claim, scripting.Mixin):
 
     Redis Data Structures:
 
-    1. Claims list (Redis set) contains claim IDs
+    1. Claims list (Redis sorted set) contains claim IDs, scored
+    by the claim expiration time
 
         Key: <project_id>.<queue_name>.claims
 
@@ -76,59 +74,84 @@ class ClaimController(storage.Claim, scripting.Mixin):
         +----------------+---------+
     """
 
-    script_names = ['claim_messages']
+    script_names = ['claim_delete', 'claim_get', 'claim_messages',
+                    'claim_update']
 
     def __init__(self, *args, **kwargs):
         super(ClaimController, self).__init__(*args, **kwargs)
         self._client = self.driver.connection
 
-        self._packer = msgpack.Packer(encoding='utf-8',
-                                      use_bin_type=True).pack
-        self._unpacker = functools.partial(msgpack.unpackb, encoding='utf-8')
-
     @decorators.lazy_property(write=False)
     def _queue_ctrl(self):
         return self.driver.queue_controller
 
-    def _get_claim_info(self, claim_id, fields, transform=int):
-        """Get one or more fields from the claim Info."""
-
-        values = self._client.hmget(claim_id, fields)
-        if values == [None]:
-            return values
-        else:
-            return [transform(v) for v in values] if transform else values
-
-    def _claim_messages(self, msgset_key, now, limit,
-                        claim_id, claim_expires, msg_ttl, msg_expires):
+    def _claim_messages(self, msgset_key, claim_msgs_key, claims_set_key,
+                        now, limit, claim_id, claim_ttl, claim_expires,
+                        msg_ttl, msg_expires):
 
         # NOTE(kgriffs): A watch on a pipe could also be used, but that
         # is less efficient and predictable, based on our experience in
         # having to do something similar in the MongoDB driver.
         func = self._scripts['claim_messages']
 
-        args = [now, limit, claim_id, claim_expires, msg_ttl, msg_expires]
-        return func(keys=[msgset_key], args=args)
+        keys = [msgset_key, claim_msgs_key, claims_set_key]
+        args = [now, limit, claim_id, claim_expires, msg_ttl, msg_expires,
+                claim_ttl]
+        return func(keys=keys, args=args)
+
+    def _get_claim(self, claim_id, claim_msgs_key):
+        """Get the claim info and its messages in a single round trip.
+
+        :returns: ([expires, ttl], hmaps) where hmaps is an iterable
+            yielding the full hash of each claimed message, or an
+            empty dict if the message no longer exists.
+        """
+
+        func = self._scripts['claim_get']
+
+        claim_info, raw_msgs = func(keys=[claim_id, claim_msgs_key])
+        return claim_info, _raw_to_hmaps(raw_msgs)
+
+    def _may_exist(self, queue, claim_id, project):
+        """Check whether a claim could exist, without looking it up.
+
+        :returns: False if the claim ID is malformed or the queue
+            does not exist, True otherwise.
+        """
+
+        # A bloom filter kept in process memory can't be used to answer
+        # negative lookups, since claims are also created by the other
+        # API workers; it would report false negatives for them. Claim
+        # IDs are always generated as UUIDs, though, so a malformed ID
+        # can be rejected without any round trips to Redis.
+        if not uuidutils.is_uuid_like(claim_id):
+            return False
 
-    def _exists(self, queue, claim_id, project):
-        client = self._client
-        claims_set_key = utils.scope_claims_set(queue, project,
-                                                QUEUE_CLAIMS_SUFFIX)
         # In some cases, the queue maybe doesn't exist. So we should check
         # whether the queue exists. Return False if no such queue exists.
 
         # Todo(flwang): We should delete all related data after the queue is
         # deleted. See the blueprint for more detail:
         # https://blueprints.launchpad.net/zaqar/+spec/clear-resources-after-delete-queue
-        if not self._queue_ctrl._exists(queue, project):
+        return self._queue_ctrl._exists(queue, project)
+
+    def _exists(self, queue, claim_id, project):
+        if not self._may_exist(queue, claim_id, project):
             return False
 
+        client = self._client
+        claims_set_key = utils.scope_claims_set(queue, project,
+                                                QUEUE_CLAIMS_SUFFIX)
+
+        # The claims set is scored by the claim's expiration time, so a
+        # single lookup tells us both whether the claim exists and
+        # whether it has expired.
+        expires = client.zscore(claims_set_key, claim_id)
+
         # Return False if no such claim exists
-        # TODO(prashanthr_): Discuss the feasibility of a bloom filter.
-        if client.zscore(claims_set_key, claim_id) is None:
+        if expires is None:
             return False
 
-        expires = self._get_claim_info(claim_id, b'e')[0]
         now = timeutils.utcnow_ts()
 
         if expires <= now:
@@ -140,9 +163,6 @@ class ClaimController(storage.Claim, scripting.Mixin):
 
         return True
 
-    def _get_claimed_message_keys(self, claim_msgs_key):
-        return self._client.lrange(claim_msgs_key, 0, -1)
-
     def _count_messages(self, queue, project):
         """Count and return the total number of claimed messages."""
 
@@ -168,18 +188,18 @@ class ClaimController(storage.Claim, scripting.Mixin):
 
             offset += len(claim_ids)
 
-            with self._client.pipeline() as pipe:
+            with self._client.pipeline(transaction=False) as pipe:
                 for cid in claim_ids:
-                    pipe.hmget(cid, 'n')
+                    pipe.hget(cid, 'n')
 
-                claim_infos = pipe.execute()
+                claim_counts = pipe.execute()
 
-            for info in claim_infos:
+            for count in claim_counts:
                 # NOTE(kgriffs): In case the claim was deleted out
                 # from under us, sanity-check that we got a non-None
-                # info list.
-                if info:
-                    num_claimed += int(info[0])
+                # count.
+                if count is not None:
+                    num_claimed += int(count)
 
         return num_claimed
 
@@ -227,17 +247,19 @@ class ClaimController(storage.Claim, scripting.Mixin):
         claim_msgs_key = utils.scope_claim_messages(claim_id,
                                                     CLAIM_MESSAGES_SUFFIX)
 
-        # basic_messages
-        msg_keys = self._get_claimed_message_keys(claim_msgs_key)
-        claimed_msgs = messages.Message.from_redis_bulk(msg_keys,
-                                                        self._client)
+        claim_info, hmaps = self._get_claim(claim_id, claim_msgs_key)
+
+        # The claim may have expired since we checked that it exists.
+        if claim_info[0] is None:
+            raise errors.ClaimDoesNotExist(claim_id, queue, project)
+
         now = timeutils.utcnow_ts()
-        basic_messages = [msg.to_basic(now)
-                          for msg in claimed_msgs if msg]
+
+        # basic_messages
+        basic_messages = messages.Message.basics_from_hmaps(hmaps, now)
 
         # claim_meta
-        now = timeutils.utcnow_ts()
-        expires, ttl = self._get_claim_info(claim_id, [b'e', b't'])
+        expires, ttl = [int(v) for v in claim_info]
         update_time = expires - ttl
         age = now - update_time
 
@@ -263,51 +285,26 @@ class ClaimController(storage.Claim, scripting.Mixin):
         msg_expires = claim_expires + grace
 
         claim_id = uuidutils.generate_uuid()
-        claimed_msgs = []
 
         # NOTE(kgriffs): Claim some messages
         msgset_key = utils.msgset_key(queue, project)
-        claimed_ids = self._claim_messages(msgset_key, now, limit,
-                                           claim_id, claim_expires,
-                                           msg_ttl, msg_expires)
-
-        if claimed_ids:
-            claimed_msgs = messages.Message.from_redis_bulk(claimed_ids,
-                                                            self._client)
-            claimed_msgs = [msg.to_basic(now) for msg in claimed_msgs]
-
-            # NOTE(kgriffs): Perist claim records
-            with self._client.pipeline() as pipe:
-                claim_msgs_key = utils.scope_claim_messages(
-                    claim_id, CLAIM_MESSAGES_SUFFIX)
-
-                for mid in claimed_ids:
-                    pipe.rpush(claim_msgs_key, mid)
-
-                pipe.expire(claim_msgs_key, claim_ttl)
-
-                claim_info = {
-                    'id': claim_id,
-                    't': claim_ttl,
-                    'e': claim_expires,
-                    'n': len(claimed_ids),
-                }
-
-                pipe.hmset(claim_id, claim_info)
-                pipe.expire(claim_id, claim_ttl)
-
-                # NOTE(kgriffs): Add the claim ID to a set so that
-                # existence checks can be performed quickly. This
-                # is also used as a watch key in order to guard
-                # against race conditions.
-                #
-                # A sorted set is used to facilitate cleaning
-                # up the IDs of expired claims.
-                claims_set_key = utils.scope_claims_set(queue, project,
-                                                        QUEUE_CLAIMS_SUFFIX)
-
-                pipe.zadd(claims_set_key, claim_expires, claim_id)
-                pipe.execute()
+        claim_msgs_key = utils.scope_claim_messages(claim_id,
+                                                    CLAIM_MESSAGES_SUFFIX)
+        claims_set_key = utils.scope_claims_set(queue, project,
+                                                QUEUE_CLAIMS_SUFFIX)
+
+        raw_msgs = self._claim_messages(msgset_key, claim_msgs_key,
+                                        claims_set_key, now, limit,
+                                        claim_id, claim_ttl, claim_expires,
+                                        msg_ttl, msg_expires)
+
+        # Nothing was claimed, so the script did not persist any
+        # claim records either.
+        if not raw_msgs:
+            return claim_id, []
+
+        claimed_msgs = messages.Message.basics_from_hmaps(
+            _raw_to_hmaps(raw_msgs), now)
 
         return claim_id, claimed_msgs
 
@@ -328,84 +325,44 @@ class ClaimController(storage.Claim, scripting.Mixin):
 
         claim_msgs_key = utils.scope_claim_messages(claim_id,
                                                     CLAIM_MESSAGES_SUFFIX)
+        claims_set_key = utils.scope_claims_set(queue, project,
+                                                QUEUE_CLAIMS_SUFFIX)
 
-        msg_keys = self._get_claimed_message_keys(claim_msgs_key)
-        claimed_msgs = messages.MessageEnvelope.from_redis_bulk(msg_keys,
-                                                                self._client)
-        claim_info = {
-            't': claim_ttl,
-            'e': claim_expires,
-        }
-
-        with self._client.pipeline() as pipe:
-            for msg in claimed_msgs:
-                if msg:
-                    msg.claim_id = claim_id
-                    msg.claim_expires = claim_expires
-
-                    if _msg_would_expire(msg, claim_expires):
-                        msg.ttl = msg_ttl
-                        msg.expires = msg_expires
-
-                    # TODO(kgriffs): Rather than writing back the
-                    # entire message, only set the fields that
-                    # have changed.
-                    #
-                    # When this change is made, don't forget to
-                    # also call pipe.expire with the new TTL value.
-                    msg.to_redis(pipe)
-
-            # Update the claim id and claim expiration info
-            # for all the messages.
-            pipe.hmset(claim_id, claim_info)
-            pipe.expire(claim_id, claim_ttl)
-
-            pipe.expire(claim_msgs_key, claim_ttl)
-
-            claims_set_key = utils.scope_claims_set(queue, project,
-                                                    QUEUE_CLAIMS_SUFFIX)
-
-            pipe.zadd(claims_set_key, claim_expires, claim_id)
+        # Reading the claimed messages and writing
+        # back the changed fields is done in a single script, so
+        # that it costs only one round trip regardless of the
+        # number of messages held by the claim.
+        func = self._scripts['claim_update']
 
-            pipe.execute()
+        keys = [claim_id, claim_msgs_key, claims_set_key]
+        args = [claim_ttl, claim_expires, msg_ttl, msg_expires, now]
+        if not func(keys=keys, args=args):
+            raise errors.ClaimDoesNotExist(claim_id, queue, project)
 
     @utils.raises_conn_error
     @utils.retries_on_connection_error
     def delete(self, queue, claim_id, project=None):
-        # NOTE(prashanthr_): Return silently when the claim
-        # does not exist
-        if not self._exists(queue, claim_id, project):
+        # Return silently when the claim does not exist. Only the
+        # checks that don't need the claim are done here; the claim
+        # itself is looked up by the claim_delete script, which saves
+        # a round trip compared to calling _exists() first.
+        if not self._may_exist(queue, claim_id, project):
             return
 
         now = timeutils.utcnow_ts()
         claim_msgs_key = utils.scope_claim_messages(claim_id,
                                                     CLAIM_MESSAGES_SUFFIX)
-
-        msg_keys = self._get_claimed_message_keys(claim_msgs_key)
-        claimed_msgs = messages.MessageEnvelope.from_redis_bulk(msg_keys,
-                                                                self._client)
-        # Update the claim id and claim expiration info
-        # for all the messages.
         claims_set_key = utils.scope_claims_set(queue, project,
                                                 QUEUE_CLAIMS_SUFFIX)
 
-        with self._client.pipeline() as pipe:
-            pipe.zrem(claims_set_key, claim_id)
-            pipe.delete(claim_id)
-            pipe.delete(claim_msgs_key)
-
-            for msg in claimed_msgs:
-                if msg:
-                    msg.claim_id = None
-                    msg.claim_expires = now
-
-                    # TODO(kgriffs): Rather than writing back the
-                    # entire message, only set the fields that
-                    # have changed.
-                    msg.to_redis(pipe)
+        func = self._scripts['claim_delete']
 
-            pipe.execute()
+        keys = [claim_id, claim_msgs_key, claims_set_key]
+        func(keys=keys, args=[now])
 
 
-def _msg_would_expire(message, now):
-    return message.expires <= now
+def _raw_to_hmaps(raw_msgs):
+    # HGETALL results come back from Lua scripts as flat
+    # [field, value, field, value, ...] lists. Convert them lazily,
+    # so that only one message hash is held in a dict at a time.
+    return (dict(zip(raw[::2], raw[1::2])) for raw in raw_msgs)
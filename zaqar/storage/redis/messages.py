@@ -321,7 +321,7 @@ class MessageController(storage.Message, scripting.Mixin):
                     # NOTE(kgriffs): If redis expired the message, it will
                     # not exist, so all we have to do is remove mid from
                     # the msgset collection.
-                    with client.pipeline() as pipe:
+                    with client.pipeline(transaction=False) as pipe:
                         for mid in mids:
                             pipe.exists(mid)
 
@@ -387,7 +387,7 @@ class MessageController(storage.Message, scripting.Mixin):
 
         # NOTE(prashanthr_): Pipelining is used here purely
         # for performance.
-        with self._client.pipeline() as pipe:
+        with self._client.pipeline(transaction=False) as pipe:
             for mid in message_ids:
                     pipe.hgetall(mid)
 
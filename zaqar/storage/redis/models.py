@@ -80,7 +80,7 @@ class MessageEnvelope(object):
 
     @staticmethod
     def from_redis_bulk(message_ids, client):
-        with client.pipeline() as pipe:
+        with client.pipeline(transaction=False) as pipe:
             for mid in message_ids:
                 pipe.hmget(mid, MSGENV_FIELD_KEYS)
 
@@ -197,7 +197,7 @@ class Message(MessageEnvelope):
 
     @staticmethod
     def from_redis_bulk(message_ids, client):
-        with client.pipeline() as pipe:
+        with client.pipeline(transaction=False) as pipe:
             for mid in message_ids:
                 pipe.hgetall(mid)
 
@@ -208,6 +208,32 @@ class Message(MessageEnvelope):
 
         return messages
 
+    @staticmethod
+    def basics_from_hmaps(hmaps, now):
+        """Convert raw message hashes directly into basic dicts.
+
+        Equivalent to calling ``Message.from_hmap(hmap).to_basic(now)``
+        for each non-empty hash, but without building (and validating)
+        an intermediate Message for each one.
+        """
+
+        decode = encodeutils.safe_decode
+        unpack = _unpack
+
+        basic_msgs = []
+        append = basic_msgs.append
+
+        for hmap in filter(None, hmaps):
+            append({
+                'id': decode(hmap[b'id']),
+                'age': now - int(hmap[b'cr']),
+                'ttl': int(hmap[b't']),
+                'body': unpack(hmap[b'b']),
+                'claim_id': decode(hmap[b'c']) or None,
+            })
+
+        return basic_msgs
+
     def to_redis(self, pipe, include_body=True):
         if not include_body:
             super(Message, self).to_redis(pipe)
@@ -18,7 +18,21 @@ import os
 from zaqar.common import decorators
 
 
+# Script sources, keyed by name. These never change while
+# the process is running, so there is no need to read them from
+# disk again for every controller instance.
+_SCRIPT_SOURCES = {}
+
+
 class Mixin(object):
+    """Registers the Lua scripts listed in script_names.
+
+    Scripts are registered with redis-py, which sends them with
+    EVALSHA and falls back to SCRIPT LOAD the first time the
+    server doesn't know about a script (NOSCRIPT), so each one is
+    only transferred to the server once.
+    """
+
     script_names = []
 
     @decorators.lazy_property(write=False)
@@ -33,8 +47,16 @@ class Mixin(object):
 
 
 def _read_script(script_name):
+    try:
+        return _SCRIPT_SOURCES[script_name]
+    except KeyError:
+        pass
+
     folder = os.path.abspath(os.path.dirname(__file__))
     filename = os.path.join(folder, 'scripts', script_name + '.lua')
 
     with open(filename, 'r') as script_file:
-        return script_file.read()
+        source = script_file.read()
+
+    _SCRIPT_SOURCES[script_name] = source
+    return source
@@ -0,0 +1,60 @@
+--[[
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local claim_id = KEYS[1]
+local claim_msgs_key = KEYS[2]
+local claims_set_key = KEYS[3]
+
+local now = tonumber(ARGV[1])
+
+-- Return silently when the claim does not exist. The claims set is
+-- scored by the claim expiration time.
+local claim_expires = redis.call('ZSCORE', claims_set_key, claim_id)
+
+if claim_expires == false then
+    return 0
+end
+
+if tonumber(claim_expires) <= now then
+    -- NOTE(kgriffs): Redis should automatically remove the
+    -- other records in the very near future. This one
+    -- has to be manually deleted, however.
+    redis.call('ZREM', claims_set_key, claim_id)
+    return 0
+end
+
+-- Release all the messages held by the claim. A "None" claim
+-- is serialized as an empty string.
+local msg_ids = redis.call('LRANGE', claim_msgs_key, 0, -1)
+
+for i, mid in ipairs(msg_ids) do
+    -- Skip messages that have already expired, so
+    -- that they are not recreated without a TTL.
+    if redis.call('EXISTS', mid) == 1 then
+        redis.call('HMSET', mid,
+                   'c', '',
+                   'c.e', now)
+    end
+end
+
+-- Remove the claim records
+redis.call('ZREM', claims_set_key, claim_id)
+redis.call('DEL', claim_id)
+redis.call('DEL', claim_msgs_key)
+
+return 1
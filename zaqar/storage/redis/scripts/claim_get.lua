@@ -0,0 +1,34 @@
+--[[
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local claim_id = KEYS[1]
+local claim_msgs_key = KEYS[2]
+
+-- Get the claim info
+local claim_info = redis.call('HMGET', claim_id, 'e', 't')
+
+-- Get every message currently held by the claim. Messages that
+-- have already expired come back as empty lists.
+local msg_ids = redis.call('LRANGE', claim_msgs_key, 0, -1)
+local claimed_msgs = {}
+
+for i, mid in ipairs(msg_ids) do
+    claimed_msgs[i] = redis.call('HGETALL', mid)
+end
+
+return {claim_info, claimed_msgs}
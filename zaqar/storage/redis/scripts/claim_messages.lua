@@ -19,6 +19,8 @@ limitations under the License.
 
 -- Read params
 local msgset_key = KEYS[1]
+local claim_msgs_key = KEYS[2]
+local claims_set_key = KEYS[3]
 
 local now = tonumber(ARGV[1])
 local limit = tonumber(ARGV[2])
@@ -26,6 +28,7 @@ local claim_id = ARGV[3]
 local claim_expires = tonumber(ARGV[4])
 local msg_ttl = tonumber(ARGV[5])
 local msg_expires = tonumber(ARGV[6])
+local claim_ttl = tonumber(ARGV[7])
 
 -- Scan for up to 'limit' unclaimed messages
 local BATCH_SIZE = 100
@@ -54,8 +57,9 @@ while (#claimed_msgs < limit) do
         -- message, the remaining messages will always be
         -- unclaimed as well.
 
+        local msg = redis.call('HMGET', mid, 'c', 'c.e', 'e')
+
         if not found_unclaimed then
-            local msg = redis.call('HMGET', mid, 'c', 'c.e')
             if msg[1] == false and msg[2] == false then
                 -- NOTE(Eva-i): It means the message expired and does not
                 -- actually exist anymore, we must later garbage collect it's
@@ -68,19 +72,27 @@ while (#claimed_msgs < limit) do
 
         if found_unclaimed then
             -- Found an unclaimed message, so claim it.
-            local msg_expires_prev = redis.call('HGET', mid, 'e')
+            local msg_expires_prev = msg[3]
             if msg_expires_prev ~= false then
                 -- NOTE(Eva-i): Condition above means the message is not
                 -- expired and we really can claim it.
-                redis.call('HMSET', mid,
-                           'c', claim_id,
-                           'c.e', claim_expires)
 
-                -- Will the message expire early?
+                -- Will the message expire early? If so, write the
+                -- new TTL fields together with the claim fields.
                 if tonumber(msg_expires_prev) < claim_expires then
                     redis.call('HMSET', mid,
+                               'c', claim_id,
+                               'c.e', claim_expires,
                                't', msg_ttl,
                                'e', msg_expires)
+
+                    -- Only the changed fields are written, so the key
+                    -- TTL has to be extended separately to match.
+                    redis.call('EXPIRE', mid, msg_ttl)
+                else
+                    redis.call('HMSET', mid,
+                               'c', claim_id,
+                               'c.e', claim_expires)
                 end
 
                 claimed_msgs[#claimed_msgs + 1] = mid
@@ -98,4 +110,34 @@ if (#msg_ids_to_cleanup ~= 0) then
     redis.call('ZREM', msgset_key, unpack(msg_ids_to_cleanup))
 end
 
+if (#claimed_msgs ~= 0) then
+    -- Persist claim records. Doing this here rather than in a
+    -- separate pipeline keeps claiming the messages and recording
+    -- the claim atomic, and saves a round trip.
+    redis.call('RPUSH', claim_msgs_key, unpack(claimed_msgs))
+
+    redis.call('EXPIRE', claim_msgs_key, claim_ttl)
+
+    redis.call('HMSET', claim_id,
+               'id', claim_id,
+               't', claim_ttl,
+               'e', claim_expires,
+               'n', #claimed_msgs)
+    redis.call('EXPIRE', claim_id, claim_ttl)
+
+    -- NOTE(kgriffs): Add the claim ID to a set so that
+    -- existence checks can be performed quickly.
+    --
+    -- A sorted set is used to facilitate cleaning
+    -- up the IDs of expired claims.
+    redis.call('ZADD', claims_set_key, claim_expires, claim_id)
+end
+
+-- Return the claimed messages themselves, rather than just their
+-- IDs, so that the caller doesn't need another round trip to
+-- fetch them.
+for i, mid in ipairs(claimed_msgs) do
+    claimed_msgs[i] = redis.call('HGETALL', mid)
+end
+
 return claimed_msgs
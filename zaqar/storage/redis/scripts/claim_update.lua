@@ -0,0 +1,80 @@
+--[[
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+--]]
+
+-- Read params
+local claim_id = KEYS[1]
+local claim_msgs_key = KEYS[2]
+local claims_set_key = KEYS[3]
+
+local claim_ttl = tonumber(ARGV[1])
+local claim_expires = tonumber(ARGV[2])
+local msg_ttl = tonumber(ARGV[3])
+local msg_expires = tonumber(ARGV[4])
+local now = tonumber(ARGV[5])
+
+-- The claim may have expired since the caller checked that it
+-- exists. The claims set is scored by the claim expiration time.
+local claim_expires_prev = redis.call('ZSCORE', claims_set_key, claim_id)
+
+if claim_expires_prev == false then
+    return 0
+end
+
+if tonumber(claim_expires_prev) <= now then
+    -- NOTE(kgriffs): Redis should automatically remove the
+    -- other records in the very near future. This one
+    -- has to be manually deleted, however.
+    redis.call('ZREM', claims_set_key, claim_id)
+    return 0
+end
+
+-- Update the claim id and claim expiration info
+-- for all the messages.
+local msg_ids = redis.call('LRANGE', claim_msgs_key, 0, -1)
+
+for i, mid in ipairs(msg_ids) do
+    local msg_expires_prev = redis.call('HGET', mid, 'e')
+
+    -- Skip messages that have already expired, so
+    -- that they are not recreated without a TTL.
+    if msg_expires_prev ~= false then
+        -- Would the message expire before the claim?
+        if tonumber(msg_expires_prev) <= claim_expires then
+            redis.call('HMSET', mid,
+                       'c', claim_id,
+                       'c.e', claim_expires,
+                       't', msg_ttl,
+                       'e', msg_expires)
+            redis.call('EXPIRE', mid, msg_ttl)
+        else
+            redis.call('HMSET', mid,
+                       'c', claim_id,
+                       'c.e', claim_expires)
+        end
+    end
+end
+
+-- Update the claim info
+redis.call('HMSET', claim_id,
+           't', claim_ttl,
+           'e', claim_expires)
+redis.call('EXPIRE', claim_id, claim_ttl)
+redis.call('EXPIRE', claim_msgs_key, claim_ttl)
+
+redis.call('ZADD', claims_set_key, claim_expires, claim_id)
+
+return 1
@@ -20,11 +20,13 @@ import mock
 from oslo_utils import timeutils
 from oslo_utils import uuidutils
 import redis
+import six
 
 from zaqar.common import cache as oslo_cache
 from zaqar.common import errors
 from zaqar import storage
 from zaqar.storage import mongodb
+from zaqar.storage.redis import claims
 from zaqar.storage.redis import controllers
 from zaqar.storage.redis import driver
 from zaqar.storage.redis import messages
@@ -154,6 +156,41 @@ class RedisUtilsTest(testing.TestBase):
         self.assertEqual(body, basic_msg['body'])
         self.assertEqual(msg.ttl, basic_msg['ttl'])
 
+    def test_basics_from_hmaps(self):
+        now = timeutils.utcnow_ts()
+        body = {'msg': 'Hello Earthlings!', 'unicode': u'ab\u00e7'}
+
+        msgs = [_create_sample_message(now=now, body=body),
+                _create_sample_message(now=now, claimed=True, body=body)]
+
+        hmaps = []
+        for msg in msgs:
+            pipe = mock.Mock()
+            msg.to_redis(pipe)
+            (mid, hmap), _ = pipe.hmset.call_args
+
+            # Under Py3K, redis-py returns field names
+            # and values as binary strings.
+            hmaps.append(dict(
+                (six.b(k), v if isinstance(v, bytes)
+                 else six.text_type(v).encode('utf-8'))
+                for k, v in hmap.items()
+            ))
+
+        # Messages that no longer exist come back as empty hashes
+        hmaps.insert(1, {})
+
+        basic_msgs = messages.Message.basics_from_hmaps(hmaps, now + 5)
+
+        expected = [messages.Message.from_hmap(hmap).to_basic(now + 5)
+                    for hmap in hmaps if hmap]
+        self.assertEqual(expected, basic_msgs)
+
+        self.assertEqual(2, len(basic_msgs))
+        self.assertEqual(5, basic_msgs[0]['age'])
+        self.assertIsNone(basic_msgs[0]['claim_id'])
+        self.assertEqual(str(msgs[1].claim_id), basic_msgs[1]['claim_id'])
+
     def test_retries_on_connection_error(self):
         num_calls = [0]
 
@@ -414,6 +451,15 @@ class RedisClaimsTest(base.ClaimControllerTest):
                           self.controller.update, queue_name,
                           claim_id, {}, project=None)
 
+    def test_malformed_claim_id_doesnt_exist(self):
+        self.queue_controller.create(self.queue_name)
+        queue_ctrl = self.controller._queue_ctrl
+
+        with mock.patch.object(queue_ctrl, '_exists') as mock_exists:
+            self.assertFalse(self.controller._exists(self.queue_name,
+                                                     'not-a-uuid', None))
+            self.assertFalse(mock_exists.called)
+
     def test_get_claim_after_expires(self):
         queue_name = 'no-such-claim'
         self.queue_controller.create(queue_name, project='fake_project')
@@ -432,6 +478,119 @@ class RedisClaimsTest(base.ClaimControllerTest):
                           self.controller.get, queue_name,
                           claim_id, project='fake_project')
 
+    def _post_message(self, ttl=60):
+        msg_ids = self.message_controller.post(self.queue_name,
+                                               [{'ttl': ttl, 'body': {}}],
+                                               client_uuid=str(uuid.uuid4()),
+                                               project=self.project)
+        return msg_ids[0]
+
+    def test_create_extends_message_key_ttl(self):
+        msg_id = self._post_message(ttl=60)
+        self.controller.create(self.queue_name, {'ttl': 300, 'grace': 0},
+                               project=self.project)
+
+        self.assertGreater(self.connection.ttl(msg_id), 60)
+
+    def test_delete_expired_claim(self):
+        msg_id = self._post_message()
+
+        now = timeutils.utcnow_ts()
+        timeutils_utcnow = 'oslo_utils.timeutils.utcnow_ts'
+
+        with mock.patch(timeutils_utcnow) as mock_utcnow:
+            mock_utcnow.return_value = now - 10
+            claim_id, messages = self.controller.create(
+                self.queue_name, {'ttl': 5, 'grace': 0},
+                project=self.project)
+
+        claims_set_key = utils.scope_claims_set(self.queue_name,
+                                                self.project,
+                                                claims.QUEUE_CLAIMS_SUFFIX)
+        self.assertIsNotNone(self.connection.zscore(claims_set_key,
+                                                    claim_id))
+
+        self.controller.delete(self.queue_name, claim_id,
+                               project=self.project)
+
+        # The stale claims set entry is removed, but the expired claim's
+        # messages are left as they are.
+        self.assertIsNone(self.connection.zscore(claims_set_key, claim_id))
+        self.assertEqual(claim_id,
+                         self.connection.hget(msg_id, 'c').decode('utf-8'))
+
+    def test_count_messages_with_missing_claim_info(self):
+        self._post_message()
+        claim_id, messages = self.controller.create(self.queue_name,
+                                                    {'ttl': 60, 'grace': 0},
+                                                    project=self.project)
+
+        # Remove the claim info, but leave the claims set entry behind
+        self.connection.delete(claim_id)
+
+        self.assertEqual(0, self.controller._count_messages(self.queue_name,
+                                                            self.project))
+
+    def test_update_and_delete_skip_expired_messages(self):
+        msg_id = self._post_message()
+        claim_id, messages = self.controller.create(self.queue_name,
+                                                    {'ttl': 60, 'grace': 0},
+                                                    project=self.project)
+
+        # Simulate Redis expiring the message while it is still claimed
+        self.connection.delete(msg_id)
+
+        self.controller.update(self.queue_name, claim_id,
+                               {'ttl': 120, 'grace': 30},
+                               project=self.project)
+        self.assertFalse(self.connection.exists(msg_id))
+
+        self.controller.delete(self.queue_name, claim_id,
+                               project=self.project)
+        self.assertFalse(self.connection.exists(msg_id))
+
+    def test_update_extends_message_key_ttl(self):
+        msg_id = self._post_message(ttl=60)
+        claim_id, messages = self.controller.create(self.queue_name,
+                                                    {'ttl': 60, 'grace': 0},
+                                                    project=self.project)
+
+        ttl, grace = 300, 60
+        self.controller.update(self.queue_name, claim_id,
+                               {'ttl': ttl, 'grace': grace},
+                               project=self.project)
+
+        self.assertGreaterEqual(self.connection.ttl(msg_id), ttl + grace)
+
+    def test_update_claim_expired_after_exists_check(self):
+        self._post_message()
+
+        now = timeutils.utcnow_ts()
+        timeutils_utcnow = 'oslo_utils.timeutils.utcnow_ts'
+
+        with mock.patch(timeutils_utcnow) as mock_utcnow:
+            mock_utcnow.return_value = now - 10
+            claim_id, messages = self.controller.create(
+                self.queue_name, {'ttl': 5, 'grace': 0},
+                project=self.project)
+
+        claims_set_key = utils.scope_claims_set(self.queue_name,
+                                                self.project,
+                                                claims.QUEUE_CLAIMS_SUFFIX)
+
+        # Pretend the claim expired right after _exists() passed, in
+        # order to exercise the check done by the update script.
+        with mock.patch.object(self.controller, '_exists') as mock_exists:
+            mock_exists.return_value = True
+            self.assertRaises(storage.errors.ClaimDoesNotExist,
+                              self.controller.update, self.queue_name,
+                              claim_id, {'ttl': 60, 'grace': 0},
+                              project=self.project)
+
+        # The claim was neither re-added to the claims set, nor renewed
+        self.assertIsNone(self.connection.zscore(claims_set_key, claim_id))
+        self.assertEqual(now - 5, int(self.connection.hget(claim_id, 'e')))
+
     def test_gc(self):
         self.queue_controller.create(self.queue_name)
 